@@ -160,6 +160,8 @@ def find_orientations(cfg, hkls=None, clean=False, profile=False, nsim=100):
 
     np.savetxt(qbar_filename, qbar.T,
                fmt='%.18e', delimiter='\t')
+    # binary sibling so fit-grains can skip the ASCII parse
+    np.save(qbar_filename + '.npy', qbar.T)
 
     gw = instrument.GrainDataWriter(os.path.join(cfg.analysis_dir, 'grains.out'))
     grain_params_list = []
@@ -1,19 +1,16 @@
 from __future__ import absolute_import
 
-import copy
 import logging
 import multiprocessing as mp
-from multiprocessing.queues import Empty
 import os
 import time
 
 import numpy as np
-from scipy.linalg.matfuncs import logm
 
 from hexrd.instrument import io
 from hexrd.imageseries.omega import OmegaImageSeries
 from hexrd.coreutil import set_planedata_exclusions
-from hexrd.matrixutil import vecMVToSymm
+from hexrd.matrixutil import logSymmInv, vecMVToSymm
 from hexrd.utils.progressbar import Bar, ETA, ProgressBar, ReverseBar
 from hexrd.xrd import transforms_CAPI as xfcapi
 from hexrd.xrd.fitting import fitGrain, objFuncFitGrain
@@ -39,20 +36,18 @@ min_nrefl = 24  # 2X number of parameters
 # =============================================================================
 
 
-def get_job_queue(cfg, ids_to_refine=None):
-    job_queue = mp.JoinableQueue()
-    # load the queue
+def get_jobs(cfg, ids_to_refine=None):
+    jobs = []
+    # load the job list
     try:
         # use an estimate of the grain parameters, if available
         estimate_f = cfg.fit_grains.estimate
         grain_params_list = np.atleast_2d(np.loadtxt(estimate_f))
         n_quats = len(grain_params_list)
-        n_jobs = 0
         for grain_params in grain_params_list:
             grain_id = grain_params[0]
             if ids_to_refine is None or grain_id in ids_to_refine:
-                job_queue.put((grain_id, grain_params[3:15]))
-                n_jobs += 1
+                jobs.append((grain_id, grain_params[3:15]))
         logger.info(
             'fitting grains using "%s" for the initial estimate',
             estimate_f
@@ -67,28 +62,34 @@ def get_job_queue(cfg, ids_to_refine=None):
             cfg.material.active.strip().replace(' ', '-'),
             )
 
-        # load quaternion file
-        quats = np.atleast_2d(
-            np.loadtxt(
-                os.path.join(
-                    cfg.working_dir,
-                    'accepted_orientations_%s.dat' % analysis_id
-                    )
-                )
+        # load quaternion file; prefer the binary sibling written by
+        # find-orientations -- loadtxt on thousands of orientations
+        # dominates startup -- but fall back to parsing the text file
+        # (and leave a .npy behind for the next run)
+        quats_f = os.path.join(
+            cfg.working_dir,
+            'accepted_orientations_%s.dat' % analysis_id
             )
+        if os.path.exists(quats_f + '.npy') and \
+                os.path.getmtime(quats_f + '.npy') >= \
+                os.path.getmtime(quats_f):
+            quats = np.atleast_2d(np.load(quats_f + '.npy', mmap_mode='r'))
+        else:
+            quats = np.atleast_2d(np.loadtxt(quats_f))
+            np.save(quats_f + '.npy', quats)
         n_quats = len(quats)
-        n_jobs = 0
         phi, n = angleAxisOfRotMat(rotMatOfQuat(quats.T))
-        for i, (phi, n) in enumerate(zip(phi, n.T)):
+
+        # build all the default grain parameters in bulk rather than
+        # hstack-ing 12 scalars per orientation
+        grain_params_all = np.zeros((n_quats, 12))
+        grain_params_all[:, :3] = phi[:, np.newaxis] * n.T
+        grain_params_all[:, 6:9] = 1.
+        for i in range(n_quats):
             if ids_to_refine is None or i in ids_to_refine:
-                exp_map = phi*n
-                grain_params = np.hstack(
-                    [exp_map, 0., 0., 0., 1., 1., 1., 0., 0., 0.]
-                    )
-                job_queue.put((i, grain_params))
-                n_jobs += 1
-    logger.info("fitting grains for %d of %d orientations", n_jobs, n_quats)
-    return job_queue, n_jobs
+                jobs.append((i, grain_params_all[i]))
+    logger.info("fitting grains for %d of %d orientations", len(jobs), n_quats)
+    return jobs
 
 
 def get_data(cfg, show_progress=False, force=False, clean=False):
@@ -121,11 +122,14 @@ def fit_grains(cfg,
                show_progress=False, ids_to_refine=None):
     # load the data
     imgser_dict, instr, pkwargs = get_data(cfg, show_progress, force, clean)
-    job_queue, njobs = get_job_queue(cfg, ids_to_refine)
+    jobs = get_jobs(cfg, ids_to_refine)
+    njobs = len(jobs)
 
     # log this before starting progress bar
     ncpus = cfg.multiprocessing
-    ncpus = ncpus if ncpus < njobs else njobs
+    # no more processes than jobs, but at least one: an empty job list
+    # then takes the serial path and still writes an empty grains file
+    ncpus = max(1, min(ncpus, njobs))
     logger.info(
         'will use %d of %d processors', ncpus, mp.cpu_count()
         )
@@ -152,33 +156,31 @@ def fit_grains(cfg,
     # finally start processing data
     if ncpus == 1:
         # no multiprocessing
-        results = []
         w = FitGrainsWorker(
-            job_queue, results,
-            imgser_dict, instr,
-            copy.deepcopy(pkwargs),
+            imgser_dict, instr, pkwargs,
             progressbar=pbar
             )
-        w.run()
+        results = w.run(jobs)
     else:
-        # multiprocessing
-        manager = mp.Manager()
-        results = manager.list()
-        for i in range(ncpus):
-            # lets make a deep copy of the pkwargs, just in case:
-            w = FitGrainsWorkerMP(job_queue, results,
-                                  imgser_dict, instr,
-                                  copy.deepcopy(pkwargs))
-            w.daemon = True
-            w.start()
-    while True:
-        n_res = len(results)
-        if show_progress:
-            pbar.update(n_res)
-        if n_res == njobs:
-            break
-        time.sleep(0.1)  # ??? check this?
-    job_queue.join()
+        # multiprocessing; worker state is built once per process by the
+        # pool initializer and jobs are drained as they complete, so
+        # there is no Manager proxy or result polling
+        results = []
+        pool = mp.Pool(ncpus, _init_mp_worker, (imgser_dict, instr, pkwargs))
+        try:
+            # hand out contiguous blocks of grain ids rather than one
+            # grain per task: amortizes the per-task IPC and keeps each
+            # process working through neighboring ids; the x4 split
+            # leaves slack for load imbalance between blocks
+            chunksize = max(1, njobs // (ncpus*4))
+            for result in pool.imap_unordered(_fit_grain_mp, jobs,
+                                              chunksize):
+                results.append(result)
+                if show_progress:
+                    pbar.update(len(results))
+        finally:
+            pool.close()
+            pool.join()
 
     # call to grain tabel output
     write_grains_file(cfg, results)
@@ -186,7 +188,30 @@ def fit_grains(cfg,
     if show_progress:
         pbar.finish()
     elapsed = time.time() - start
-    logger.info('processed %d grains in %g minutes', n_res, elapsed/60)
+    logger.info('processed %d grains in %g minutes', len(results), elapsed/60)
+
+
+def _spots_to_table(patch_output):
+    """
+    Assemble the reflection table for one panel from pull_spots output.
+
+    Columns follow the spots file layout (see FitGrainsWorker.fit_grains);
+    pred X/Y (cols 13:15) are not in the patch output and not used by the
+    fit, so they are left as nan.
+    """
+    table = np.nan*np.ones((len(patch_output), 17))
+    for i, (peak_id, hkl_id, hkl, sum_int, max_int,
+            pangs, mangs, mxy) in enumerate(patch_output):
+        table[i, 0] = peak_id
+        table[i, 1] = hkl_id
+        table[i, 2:5] = hkl
+        table[i, 7:10] = pangs
+        if mangs is not None:
+            table[i, 5] = sum_int
+            table[i, 6] = max_int
+            table[i, 10:13] = mangs
+            table[i, 15:17] = mxy
+    return table
 
 
 def write_grains_file(cfg, results, output_name=None):
@@ -211,11 +236,7 @@ class FitGrainsWorker(object):
     """
     Wrapper class for looped grains fitting
     """
-    def __init__(self, jobs, results, imgser_dict, instr, pkwargs, **kwargs):
-        # (id, g_refined, compl, eMat, resd) in sorted(results)
-        self._jobs = jobs
-        self._results = results
-
+    def __init__(self, imgser_dict, instr, pkwargs, **kwargs):
         # a dict containing the rest of the parameters
         self._p = pkwargs
 
@@ -233,19 +254,39 @@ class FitGrainsWorker(object):
         # logger.info("\tset panel buffer for %s to: %s", det_key, buff_str)
         self._instr = instr
 
+        # per-detector refit tolerances are invariant over the whole run;
+        # compute them once instead of per grain per iteration
+        self._refit_tols = None
+        if self._p['refit_tol'] is not None:
+            self._refit_tols = dict.fromkeys(self._imgsd)
+            for det_key, panel in instr.detectors.iteritems():
+                ims = self._imgsd[det_key]  # !!! must be OmegaImageSeries
+                ome_step = sum(np.r_[-1, 1]*ims.metadata['omega'][0, :])
+                self._refit_tols[det_key] = (
+                    self._p['refit_tol'][0]*panel.pixel_size_col,
+                    self._p['refit_tol'][0]*panel.pixel_size_row,
+                    self._p['refit_tol'][1]*ome_step
+                )
+
         # lets make a couple shortcuts:
         # !!! is it still necessary to re-cast bmat?
-        self._p['bmat'] = np.ascontiguousarray(
+        # kept as attributes so pkwargs is never written to and can be
+        # shared between workers
+        self._bmat = np.ascontiguousarray(
             self._p['plane_data'].latVecOps['B']
         )
-        self._p['wlen'] = self._p['plane_data'].wavelength
+        self._wlen = self._p['plane_data'].wavelength
         self._pbar = kwargs.get('progressbar', None)
 
+        # in-memory reflection tables from the most recent pull_spots;
+        # stays None in fit-only mode
+        self._gtable_dict = None
+
     def pull_spots(self, grain_id, grain_params, iteration):
         """
         ??? maybe pass interpolation option
         """
-        complvec, results = self._instr.pull_spots(
+        complvec, spots = self._instr.pull_spots(
             self._p['plane_data'], grain_params,
             self._imgsd,
             tth_tol=self._p['tth_tol'][iteration],
@@ -259,6 +300,11 @@ class FitGrainsWorker(object):
             filename=self._p['spots_stem'] % grain_id,
             save_spot_list=False, quiet=True,
             check_only=False, interp='nearest')
+        # keep the reflection tables in memory; the spots files just
+        # written don't need to be re-parsed with loadtxt in fit_grains
+        self._gtable_dict = dict.fromkeys(spots)
+        for det_key in spots:
+            self._gtable_dict[det_key] = _spots_to_table(spots[det_key])
 
     def fit_grains(self, grain_id, grain_params, refit_tol=None):
         """
@@ -288,16 +334,25 @@ class FitGrainsWorker(object):
         for det_key in self._culled_results:
             panel = self._instr.detectors[det_key]
 
-            presults = np.loadtxt(spots_fname_dict[det_key])
+            if self._gtable_dict is not None:
+                # tables cached by pull_spots this pass
+                presults = self._gtable_dict[det_key]
+            else:
+                # fit-only mode; must read the spots files from disk
+                presults = np.loadtxt(spots_fname_dict[det_key])
 
-            valid_refl_ids = presults[:, 0] >= 0
-            spot_ids = presults[:, 1]
+            # work on contiguous copies of the columns used below;
+            # strided views thrash cache in the comparisons and lookups
+            valid_refl_ids = np.ascontiguousarray(presults[:, 0]) >= 0
+            spot_ids = np.ascontiguousarray(presults[:, 1])
 
             # find unsaturated spots on this panel
             if panel.saturation_level is None:
                 unsat_spots = np.ones(len(valid_refl_ids))
             else:
-                unsat_spots = presults[:, 6] < panel.saturation_level
+                unsat_spots = \
+                    np.ascontiguousarray(presults[:, 6]) < \
+                    panel.saturation_level
 
             idx = np.logical_and(valid_refl_ids, unsat_spots)
 
@@ -318,11 +373,7 @@ class FitGrainsWorker(object):
                             mark_these = np.array(
                                 this_table[these_overlaps, 1], dtype=int
                             )
-                            otidx = [
-                                np.where(spot_ids == mt)[0]
-                                for mt in mark_these
-                            ]
-                            overlaps[otidx] = True
+                            overlaps[np.in1d(spot_ids, mark_these)] = True
                 idx = np.logical_and(idx, ~overlaps)
                 # logger.info("found overlap table for '%s'", det_key)
             except(IOError, IndexError):
@@ -332,7 +383,7 @@ class FitGrainsWorker(object):
             # attach to proper dict entry
             self._culled_results[det_key] = presults[idx, :]
             num_refl_tot += len(valid_refl_ids)
-            num_refl_valid += sum(valid_refl_ids)
+            num_refl_valid += valid_refl_ids.sum()
             pass  # now we have culled data
 
         # CAVEAT: completeness from pullspots only; incl saturated and overlaps
@@ -347,7 +398,7 @@ class FitGrainsWorker(object):
         else:
             grain_params_fit = fitGrain(
                     grain_params, self._instr, self._culled_results,
-                    self._p['bmat'], self._p['wlen']
+                    self._bmat, self._wlen
                 )
         # get chisq
         # TODO: do this while evaluating fit???
@@ -355,7 +406,7 @@ class FitGrainsWorker(object):
                 grain_params_fit[gFlag_ref], grain_params_fit, gFlag_ref,
                 self._instr,
                 self._culled_results,
-                self._p['bmat'], self._p['wlen'],
+                self._bmat, self._wlen,
                 self._p['omega_period'],
                 simOnly=False, return_value_flag=2)
 
@@ -366,7 +417,7 @@ class FitGrainsWorker(object):
                 grain_params_fit[gFlag_ref], grain_params_fit, gFlag_ref,
                 self._instr,
                 self._culled_results,
-                self._p['bmat'], self._p['wlen'],
+                self._bmat, self._wlen,
                 self._p['omega_period'],
                 simOnly=True, return_value_flag=2)
 
@@ -376,18 +427,13 @@ class FitGrainsWorker(object):
             for det_key in culled_results_r:
                 presults = self._culled_results[det_key]
 
-                ims = self._imgsd[det_key]  # !!! must be OmegaImageSeries
-                ome_step = sum(np.r_[-1, 1]*ims.metadata['omega'][0, :])
-
                 # measured vals for pull spots
                 xyo_det = presults[:, [15, 16, 12]]
 
                 # previous solutions calc vals
                 xyo_det_fit = xyo_det_fit_dict[det_key]
 
-                xpix_tol = self._p['refit_tol'][0]*panel.pixel_size_col
-                ypix_tol = self._p['refit_tol'][0]*panel.pixel_size_row
-                fome_tol = self._p['refit_tol'][1]*ome_step
+                xpix_tol, ypix_tol, fome_tol = self._refit_tols[det_key]
 
                 # define difference vectors for spot fits
                 x_diff = abs(xyo_det[:, 0] - xyo_det_fit['calc_xy'][:, 0])
@@ -407,14 +453,14 @@ class FitGrainsWorker(object):
 
                 # attach to proper dict entry
                 culled_results_r[det_key] = presults[idx_new, :]
-                num_refl_valid += sum(idx_new)
+                num_refl_valid += idx_new.sum()
                 pass
 
             # only execute fit if left with enough reflections
             if num_refl_valid > min_nrefl:
                 grain_params_fit = fitGrain(
                     grain_params_fit, self._instr, culled_results_r,
-                    self._p['bmat'], self._p['wlen'],
+                    self._bmat, self._wlen,
                 )
                 # get chisq
                 # TODO: do this while evaluating fit???
@@ -423,7 +469,7 @@ class FitGrainsWorker(object):
                         grain_params_fit, gFlag_ref,
                         self._instr,
                         culled_results_r,
-                        self._p['bmat'], self._p['wlen'],
+                        self._bmat, self._wlen,
                         self._p['omega_period'],
                         simOnly=False, return_value_flag=2)
                 pass  # close check on number of valid refls
@@ -434,19 +480,19 @@ class FitGrainsWorker(object):
         """
         strain tensor calculation
         """
-        return logm(np.linalg.inv(vecMVToSymm(grain_params[6:])))
+        return logSymmInv(vecMVToSymm(grain_params[6:]))
 
     def get_residuals(self, grain_params):
         return objFuncFitGrain(grain_params[gFlag_ref],
                                grain_params, gFlag_ref,
                                self._instr,
                                self._culled_results,
-                               self._p['bmat'], self._p['wlen'],
+                               self._bmat, self._wlen,
                                self._p['omega_period'],
                                simOnly=False, return_value_flag=2)
 
-    def loop(self):
-        id, grain_params = self._jobs.get(False)
+    def loop(self, id, grain_params):
+        # returns (id, g_refined, compl, eMat, resd)
         iterations = (0, len(self._p['eta_tol']))
         for iteration in range(*iterations):
             # pull spots if asked to, otherwise just fit
@@ -467,23 +513,27 @@ class FitGrainsWorker(object):
         emat = self.get_e_mat(grain_params)
         resd = self.get_residuals(grain_params)
 
-        self._results.append((id, grain_params, compl, emat, resd))
-        self._jobs.task_done()
+        return id, grain_params, compl, emat, resd
+
+    def run(self, jobs):
+        results = []
+        for id, grain_params in jobs:
+            results.append(self.loop(id, grain_params))
+            if self._pbar is not None:
+                self._pbar.update(len(results))
+        return results
+
+
+# per-process worker instance for the multiprocessing pool; built by the
+# pool initializer so the pickleable job function can stay at module level
+_mp_worker = None
 
-    def run(self):
-        n_res = 0
-        while True:
-            try:
-                self.loop()
-                n_res += 1
-                if self._pbar is not None:
-                    self._pbar.update(n_res)
-            except Empty:
-                break
 
+def _init_mp_worker(imgser_dict, instr, pkwargs):
+    global _mp_worker
+    _mp_worker = FitGrainsWorker(imgser_dict, instr, pkwargs)
 
-class FitGrainsWorkerMP(FitGrainsWorker, mp.Process):
 
-    def __init__(self, *args, **kwargs):
-        mp.Process.__init__(self)
-        FitGrainsWorker.__init__(self, *args, **kwargs)
+def _fit_grain_mp(job):
+    id, grain_params = job
+    return _mp_worker.loop(id, grain_params)
@@ -2,6 +2,7 @@ from __future__ import absolute_import
 
 import copy
 import logging
+from multiprocessing.pool import ThreadPool
 import os
 import sys
 import time
@@ -9,7 +10,7 @@ import time
 import yaml
 
 import numpy as np
-from scipy.sparse import coo_matrix
+from scipy.sparse import csr_matrix
 
 from hexrd.coreutil import initialize_experiment
 from hexrd.utils.progressbar import (
@@ -23,43 +24,74 @@ if USE_NUMBA:
 logger = logging.getLogger(__name__)
 
 if USE_NUMBA:
-    @numba.njit
-    def extract_ijv(in_array, threshold, out_i, out_j, out_v):
-        n = 0
-        w, h = in_array.shape
-
-        for i in range(w):
-            for j in range(h):
-                v = in_array[i,j]
+    @numba.njit(parallel=True, cache=True)
+    def _threshold_extract(frame, threshold):
+        n_rows, n_cols = frame.shape
+
+        # first pass: per-row nonzero counts, prefix-summed into indptr
+        counts = np.zeros((n_rows + 1,), dtype=np.int64)
+        for i in numba.prange(n_rows):
+            c = 0
+            for j in range(n_cols):
+                if frame[i, j] > threshold:
+                    c += 1
+            counts[i + 1] = c
+        indptr = np.cumsum(counts)
+
+        # second pass: fill (vals, cols) at each row's offset
+        vals = np.empty((indptr[n_rows],), dtype=frame.dtype)
+        cols = np.empty((indptr[n_rows],), dtype=np.int64)
+        for i in numba.prange(n_rows):
+            n = indptr[i]
+            for j in range(n_cols):
+                v = frame[i, j]
                 if v > threshold:
-                    out_v[n] = v
-                    out_i[n] = i
-                    out_j[n] = j
+                    vals[n] = v
+                    cols[n] = j
                     n += 1
 
-        return n
-
-    class CooMatrixBuilder(object):
-        def __init__(self):
-            self.v_buff = np.empty((2048*2048,), dtype=np.int16)
-            self.i_buff = np.empty((2048*2048,), dtype=np.int16)
-            self.j_buff = np.empty((2048*2048,), dtype=np.int16)
+        return vals, cols, indptr
 
+    class CsrMatrixBuilder(object):
         def build_matrix(self, frame, threshold):
-            count = extract_ijv(frame, threshold,
-                                self.i_buff, self.j_buff, self.v_buff)
-            return coo_matrix((self.v_buff[0:count].copy(),
-                               (self.i_buff[0:count].copy(),
-                                self.j_buff[0:count].copy())),
-                              shape=frame.shape)
+            vals, cols, indptr = _threshold_extract(frame, threshold)
+            return csr_matrix((vals, cols, indptr), shape=frame.shape)
 
 else: # not USE_NUMBA
-    class CooMatrixBuilder(object):
+    class CsrMatrixBuilder(object):
         def build_matrix(self, frame, threshold):
             mask = frame > threshold
-            return coo_matrix((frame[mask], mask.nonzero()),
+            rows, cols = mask.nonzero()
+            return csr_matrix((frame[rows, cols], cols,
+                               _csr_indptr(rows, frame.shape[0])),
                               shape=frame.shape)
 
+
+def _csr_indptr(rows, n_rows):
+    # nonzeros are extracted in row-major order, so (data, cols) are already
+    # valid CSR arrays; only indptr is needed, skipping the internal COO
+    # conversion a coo_matrix/csr_matrix((data, (i, j))) build would do
+    indptr = np.zeros((n_rows + 1,), dtype=np.intp)
+    np.cumsum(np.bincount(rows, minlength=n_rows), out=indptr[1:])
+    return indptr
+
+
+def frames_to_csr_soa(frame_list):
+    """Concatenate per-frame CSR matrices into one structure-of-arrays blob.
+
+    Returns (data, indices, indptr, frame_offsets) where indptr is
+    (n_frames, n_rows + 1) and frame k's nonzeros live in
+    data[frame_offsets[k]:frame_offsets[k + 1]].
+    """
+    nnz = np.array([m.nnz for m in frame_list])
+    frame_offsets = np.zeros((len(frame_list) + 1,), dtype=np.intp)
+    np.cumsum(nnz, out=frame_offsets[1:])
+    data = np.concatenate([m.data for m in frame_list])
+    indices = np.concatenate([m.indices for m in frame_list])
+    indptr = np.vstack([m.indptr for m in frame_list])
+    return data, indices, indptr, frame_offsets
+
+
 def load_frames(reader, cfg, show_progress=False):
     # TODO: this should be updated to read only the frames requested in cfg
     # either the images start, step, stop, or based on omega start, step, stop
@@ -73,15 +105,39 @@ def load_frames(reader, cfg, show_progress=False):
         widgets = [Bar('>'), ' ', ETA(), ' ', ReverseBar('<')]
         pbar = ProgressBar(widgets=widgets, maxval=n_frames).start()
 
-    frame_list = []
-    coo_builder = CooMatrixBuilder()
-    for i in range(n_frames):
-        frame = reader.read()
-        frame_list.append(coo_builder.build_matrix(frame, cfg.fit_grains.threshold))
-
-        if show_progress:
-            pbar.update(i)
-    frame_list = np.array(frame_list)
+    threshold = cfg.fit_grains.threshold
+    csr_builder = CsrMatrixBuilder()
+
+    # bound the pool; beyond a few threads the disk is the limit
+    n_workers = min(max(cfg.multiprocessing, 1), 8)
+    pool = ThreadPool(n_workers)
+    try:
+        # double-buffered pipeline: reader.read() is stateful, so frames
+        # are read serially here (where its errors also propagate) while
+        # the pool sparsifies the previous batch; at most two batches of
+        # dense frames are ever in flight, vs the whole scan if the pool
+        # were fed as fast as the reader can go
+        frame_list = []
+        pending = None
+        n_read = 0
+        while n_read < n_frames:
+            batch = [reader.read()
+                     for _ in range(min(n_workers, n_frames - n_read))]
+            n_read += len(batch)
+            if pending is not None:
+                frame_list.extend(pending.get())
+                if show_progress:
+                    pbar.update(len(frame_list) - 1)
+            pending = pool.map_async(
+                lambda frame: csr_builder.build_matrix(frame, threshold),
+                batch)
+        if pending is not None:
+            frame_list.extend(pending.get())
+            if show_progress:
+                pbar.update(len(frame_list) - 1)
+    finally:
+        pool.close()
+        pool.join()
     omega_start = np.radians(cfg.image_series.omega.start)
     omega_step = np.radians(cfg.image_series.omega.step)
     reader = [frame_list, [omega_start, omega_step]]
@@ -99,7 +155,8 @@ def cache_frames(reader, cfg, show_progress=False, overwrite=True):
     arrs = {}
     arrs['omega'] = np.array(reader[1])
     arrs['shape'] = np.array(reader[0][0].shape)
-    for i, coo in enumerate(reader[0]):
+    for i, mat in enumerate(reader[0]):
+        coo = mat.tocoo()
         arrs['%d_data' % i] = coo.data
         arrs['%d_row' % i] = coo.row
         arrs['%d_col' % i] = coo.col
@@ -147,7 +204,7 @@ def get_frames(reader, cfg, show_progress=False, force=False, clean=False):
         shape = npz['shape'].tolist()
         frame_list = []
         for i in range(n_frames):
-            frame_list.append(coo_matrix((npz['%d_data' % i],
+            frame_list.append(csr_matrix((npz['%d_data' % i],
                                           (npz['%d_row' % i],
                                            npz['%d_col' % i])),
                                          shape=shape))
@@ -204,7 +204,7 @@ def get_instrument_parameters(cfg):
     with open(cfg.instrument.parameters, 'r') as f:
         # only one panel for now
         # TODO: configurize this
-        return [item for item in yaml.load_all(f)][0]
+        return next(yaml.safe_load_all(f))
 
 
 def get_detector_parameters(instr_cfg):
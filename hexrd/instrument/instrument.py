@@ -111,6 +111,41 @@ def centers_of_edge_vec(edges):
     return np.average(np.vstack([edges[:-1], edges[1:]]), axis=0)
 
 
+# cache of tolerance-dependent pull_spots setup keyed on
+# (delta_ome, tth_tol, eta_tol, ome_tol); a run cycles through a small fixed
+# set of tolerance tuples, so each specialization is built exactly once
+_tol_setup_cache = {}
+
+
+def _tolerance_setup(delta_ome, tth_tol, eta_tol, ome_tol):
+    key = (delta_ome, tth_tol, eta_tol, ome_tol)
+    try:
+        return _tol_setup_cache[key]
+    except KeyError:
+        # make omega grid for frame expansion around reference frame
+        # in DEGREES
+        ndiv_ome, ome_del = make_tolerance_grid(
+            delta_ome, ome_tol, 1, adjust_window=True,
+        )
+
+        # generate structuring element for connected component labeling
+        if ndiv_ome == 1:
+            label_struct = ndimage.generate_binary_structure(2, 2)
+        else:
+            label_struct = ndimage.generate_binary_structure(3, 3)
+
+        # patch vertex generator (global for instrument)
+        tol_vec = 0.5*np.radians(
+            [-tth_tol, -eta_tol,
+             -tth_tol,  eta_tol,
+             tth_tol,  eta_tol,
+             tth_tol, -eta_tol])
+
+        setup = (ndiv_ome, ome_del, label_struct, tol_vec)
+        _tol_setup_cache[key] = setup
+        return setup
+
+
 # =============================================================================
 # CLASSES
 # =============================================================================
@@ -560,17 +595,10 @@ class HEDMInstrument(object):
         # delta omega in DEGREES grabbed from first imageseries in the dict
         delta_ome = oims0.omega[0, 1] - oims0.omega[0, 0]
 
-        # make omega grid for frame expansion around reference frame
-        # in DEGREES
-        ndiv_ome, ome_del = make_tolerance_grid(
-            delta_ome, ome_tol, 1, adjust_window=True,
-        )
-
-        # generate structuring element for connected component labeling
-        if ndiv_ome == 1:
-            label_struct = ndimage.generate_binary_structure(2, 2)
-        else:
-            label_struct = ndimage.generate_binary_structure(3, 3)
+        # tolerance-dependent setup, specialized per tolerance tuple and
+        # cached across the per-grain calls of a run
+        ndiv_ome, ome_del, label_struct, tol_vec = _tolerance_setup(
+            delta_ome, tth_tol, eta_tol, ome_tol)
 
         # simulate rotation series
         sim_results = self.simulate_rotation_series(
@@ -579,13 +607,6 @@ class HEDMInstrument(object):
             ome_ranges=ome_ranges,
             ome_period=ome_period)
 
-        # patch vertex generator (global for instrument)
-        tol_vec = 0.5*np.radians(
-            [-tth_tol, -eta_tol,
-             -tth_tol,  eta_tol,
-             tth_tol,  eta_tol,
-             tth_tol, -eta_tol])
-
         # prepare output if requested
         if filename is not None and output_format.lower() == 'hdf5':
             this_filename = os.path.join(dirname, filename)
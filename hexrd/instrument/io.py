@@ -3,7 +3,6 @@ from __future__ import print_function
 
 import h5py
 import numpy as np
-from scipy.linalg.matfuncs import logm
 
 from hexrd import matrixutil as mutil
 from hexrd.xrd.transforms_CAPI import makeRotMatOfExpMap
@@ -27,6 +26,12 @@ class PatchDataWriter(object):
             self._delim.join(np.tile('{:<12}', 2)).format(*header_items[5:7]),
             self._delim.join(np.tile('{:<23}', 10)).format(*header_items[7:17])
         ])
+        # row format is fixed; build it once rather than per dump_patch call
+        self._fmtstr = self._delim.join([
+            self._delim.join(np.tile('{:<6d}', 5)),
+            self._delim.join(np.tile('{:<12e}', 2)),
+            self._delim.join(np.tile('{:<23.16e}', 10))
+        ])
         if isinstance(filename, file):
             self.fid = filename
         else:
@@ -59,11 +64,7 @@ class PatchDataWriter(object):
             + pxy.tolist() \
             + mxy.tolist()
 
-        output_str = self._delim.join(
-            [self._delim.join(np.tile('{:<6d}', 5)).format(*res[:5]),
-             self._delim.join(np.tile('{:<12e}', 2)).format(*res[5:7]),
-             self._delim.join(np.tile('{:<23.16e}', 10)).format(*res[7:])]
-        )
+        output_str = self._fmtstr.format(*res)
         print(output_str, file=self.fid)
         return output_str
 
@@ -92,6 +93,11 @@ class GrainDataWriter(object):
                 np.tile('{:<23}', len(header_items) - 3)
                 ).format(*header_items[3:])]
         )
+        # row format is fixed; build it once rather than per dump_grain call
+        self._fmtstr = self._delim.join(
+            ['{:<12d}', '{:<12f}', '{:<12e}']
+            + ['{:<23.16e}']*(len(header_items) - 3)
+        )
         if isinstance(filename, file):
             self.fid = filename
         else:
@@ -110,20 +116,13 @@ class GrainDataWriter(object):
             "len(grain_params) must be 12, not %d" % len(grain_params)
 
         # extract strain
-        emat = logm(np.linalg.inv(mutil.vecMVToSymm(grain_params[6:])))
+        emat = mutil.logSymmInv(mutil.vecMVToSymm(grain_params[6:]))
         evec = mutil.symmToVecMV(emat, scale=False)
 
         res = [int(grain_id), completeness, chisq] \
             + grain_params.tolist() \
             + evec.tolist()
-        output_str = self._delim.join(
-            [self._delim.join(
-                ['{:<12d}', '{:<12f}', '{:<12e}']
-             ).format(*res[:3]),
-             self._delim.join(
-                np.tile('{:<23.16e}', len(res) - 3)
-             ).format(*res[3:])]
-        )
+        output_str = self._fmtstr.format(*res)
         print(output_str, file=self.fid)
         return output_str
 
@@ -192,6 +192,15 @@ def vecMVToSymm(A, scale=True):
     symm[1, 0] = A[5] / fac
     return symm
 
+def logSymmInv(A):
+    """
+    matrix log of the inverse of a symmetric positive-definite 3x3,
+    via eigendecomposition; equivalent to logm(inv(A)) without the
+    general Schur-based solve
+    """
+    w, v = num.linalg.eigh(A)
+    return num.dot(v * -num.log(w), v.T)
+
 def vecMVCOBMatrix(R):
     """
     GenerateS array of 6 x 6 basis transformation matrices for the
@@ -38,6 +38,10 @@ from hexrd.xrd import distortion as dFuncs
 
 from hexrd.xrd.xrdutil import extract_detector_transformation
 
+from hexrd import USE_NUMBA
+if USE_NUMBA:
+    import numba
+
 return_value_flag = None
 epsf = np.finfo(float).eps  # ~2.2e-16
 sqrt_epsf = np.sqrt(epsf)  # ~1.5e-8
@@ -95,6 +99,30 @@ gScl_ref = np.ones(12, dtype=bool)
 # =============================================================================
 
 
+if USE_NUMBA:
+    @numba.njit(cache=True, fastmath=True)
+    def _sum_resd_sq(resd):
+        # builtin sum() over an ndarray iterates in Python; this runs the
+        # reduction in one compiled pass with no resd**2 temporary
+        s = 0.0
+        for i in range(resd.size):
+            s += resd[i]*resd[i]
+        return s
+
+    @numba.njit(cache=True, fastmath=True)
+    def _sum_resd_abs(resd):
+        s = 0.0
+        for i in range(resd.size):
+            s += abs(resd[i])
+        return s
+else:
+    def _sum_resd_sq(resd):
+        return float(np.dot(resd, resd))
+
+    def _sum_resd_abs(resd):
+        return float(np.abs(resd).sum())
+
+
 def matchOmegas(xyo_det, hkls_idx, chi, rMat_c, bMat, wavelength,
                 vInv=vInv_ref, beamVec=bVec_ref, etaVec=eta_ref,
                 omePeriod=None):
@@ -126,9 +154,10 @@ def matchOmegas(xyo_det, hkls_idx, chi, rMat_c, bMat, wavelength,
     else:
         # CAPI version gives vstacked angles... must be (2, nhkls)
         calc_omes = np.vstack([oangs0[:, 2], oangs1[:, 2]])
-    if omePeriod is not None:
-        calc_omes = np.vstack([xf.mapAngle(oangs0[:, 2], omePeriod),
-                               xf.mapAngle(oangs1[:, 2], omePeriod)])
+        if omePeriod is not None:
+            # map both solution branches in one pass over the stacked
+            # array rather than stacking twice and mapping each branch
+            calc_omes = xf.mapAngle(calc_omes, omePeriod)
     # do angular difference
     diff_omes = xf.angularDifference(np.tile(meas_omes, (2, 1)), calc_omes)
     match_omes = np.argsort(diff_omes, axis=0) == 0
@@ -340,7 +369,7 @@ def objFuncSX(pFit, pFull, pFlag, dFunc, dFlag,
                             ]).flatten()
         if return_value_flag == 1:
             # return scalar sum of squared residuals
-            retval = sum(abs(retval))
+            retval = _sum_resd_abs(retval)
         elif return_value_flag == 2:
             # return DOF-normalized chisq
             # TODO: check this calculation
@@ -350,7 +379,7 @@ def objFuncSX(pFit, pFull, pFlag, dFunc, dFlag,
             else:
                 nu_fac = 1.
             nu_fac = 1 / (npts - len(pFit) - 1.)
-            retval = nu_fac * sum(retval**2)
+            retval = nu_fac * _sum_resd_sq(retval)
     return retval
 
 # =============================================================================
@@ -551,7 +580,7 @@ def objFuncFitGrain(gFit, gFull, gFlag,
                             ]).flatten()
         if return_value_flag == 1:
             # return scalar sum of squared residuals
-            retval = sum(abs(retval))
+            retval = _sum_resd_abs(retval)
         elif return_value_flag == 2:
             # return DOF-normalized chisq
             # TODO: check this calculation
@@ -560,5 +589,5 @@ def objFuncFitGrain(gFit, gFull, gFlag,
                 nu_fac = 1. / denom
             else:
                 nu_fac = 1.
-            retval = nu_fac * sum(retval**2)
+            retval = nu_fac * _sum_resd_sq(retval)
     return retval
@@ -0,0 +1,22 @@
+import sys, os, time, random
+import numpy as np
+
+from scipy.linalg import logm
+
+from hexrd import matrixutil as mutil
+
+tol = 1.0e-10
+
+# random symmetric positive-definite stretch tensors with modest
+# anisotropy, like the inv(V_s) matrices fed to logSymmInv in practice
+np.random.seed(0)
+nTrials = 200
+worst = 0.0
+for i in range(nTrials):
+    B = 0.05 * np.random.randn(3, 3)
+    A = np.eye(3) + 0.5 * (B + B.T)
+    err = np.max(np.abs(mutil.logSymmInv(A) - logm(np.linalg.inv(A))))
+    worst = max(worst, err)
+
+print "logSymmInv matches logm(inv(A)):      ", worst < tol
+print "worst absolute deviation:             ", worst